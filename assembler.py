@@ -55,298 +55,227 @@
 # MOVEI V C  - execute C <= value V
 #
 
-# 2-pass assembler
-# pass 1: read through the instructions and put numbers on each instruction location
-#         calculate the label values
-#
-# pass 2: read through the instructions and build the machine instructions
+# 1-pass assembler
+# read through the file once, recording label locations and building the
+# machine instructions; instructions that reference a label get a zero
+# address and a fixup, and the fixups are patched once the file is done
 #
 
+from __future__ import annotations
+
+import os
 import sys
+from array import array
+from typing import Callable, Iterable, Iterator
 
-# converts d to an 8-bit 2-s complement binary value
-def dec2comp8( d, linenum ):
+# converts the token s to an 8-bit 2-s complement value, accepting
+# -128 to 255 so that both signed and unsigned bytes can be given
+def dec2comp8( s: str ) -> int:
     try:
-        if d > 0:
-            l = d.bit_length()
-            v = "00000000"
-            v = v[0:8-l] + format( d, 'b')
-        elif d < 0:
-            dt = 128 + d
-            l = dt.bit_length()
-            v = "10000000"
-            v = v[0:8-l] + format( dt, 'b')[:]
-        else:
-            v = "00000000"
-    except:
-        print ('Invalid decimal number on line %d') % (linenum)
-        exit()
-
-    return v
-
-# converts d to an 8-bit unsigned binary value
-def dec2bin8( d, linenum ):
-    if d > 0:
-        l = d.bit_length()
-        v = "00000000"
-        v = v[0:8-l] + format( d, 'b' )
-    elif d == 0:
-        v = "00000000"
-    else:
-        print ('Invalid address on line %d: value is negative') % (linenum)
-        exit()
-
-    return v
-
-
-# Tokenizes the input data, discarding white space and comments
-# returns the tokens as a list of lists, one list for each line.
-#
-# The tokenizer also converts each character to lower case.
-def tokenize( fp ):
-    tokens = []
+        d = int( s )
+    except ValueError:
+        raise ValueError( "ERROR: a value is not a decimal number, CHECK: " + s )
+    if not -128 <= d <= 255:
+        raise ValueError( "ERROR: a value is out of range, CHECK: -128 to 255" )
 
-    # start of the file
-    fp.seek(0)
+    return d & 0xFF
+
+# converts the token s to an 8-bit unsigned address
+def dec2bin8( s: str ) -> int:
+    try:
+        d = int( s )
+    except ValueError:
+        raise ValueError( "ERROR: an address is not a decimal number, CHECK: " + s )
+    if not 0 <= d <= 255:
+        raise ValueError( "ERROR: an address is out of range, CHECK: 0 to 255" )
+
+    return d
 
-    lines = fp.readlines()
 
-    # strip white space and comments from each line
+# Tokenizes the input lines, discarding white space and comments
+# yields the tokens as a list for each line.
+#
+# The tokenizer also converts each character to lower case.
+def tokenize( lines: Iterable[str] ) -> Iterator[list[str]]:
+    # strip comments and white space from each line
     for line in lines:
-        ls = line.strip()
-        uls = ''
-        for c in ls:
-            if c != '#':
-                uls = uls + c
-            else:
-                break
+        payload = line.split('#', 1)[0].strip()
 
         # skip blank lines
-        if len(uls) == 0:
+        if not payload:
             continue
 
         # split on white space
-        words = uls.split()
+        yield payload.lower().split()
+
+
+#CPU tables, register name -> 3-bit register field
+tableB: dict[str, int] = {"ra":0, "rb":1, "rc":2, "rd":3, "re":4, "sp":5}
+tableC: dict[str, int] = {"ra":0, "rb":1, "rc":2, "rd":3, "re":4, "sp":5, "pc":6, "cr":7}
+tableD: dict[str, int] = {"ra":0, "rb":1, "rc":2, "rd":3, "re":4, "sp":5, "pc":6, "ir":7}
+tableE: dict[str, int] = {"ra":0, "rb":1, "rc":2, "rd":3, "re":4, "sp":5, "zero":6, "one":7}
+
+
+# instruction encoders, each takes the tokenized line, the opcode word,
+# the fixup list and the address of the instruction and returns the
+# 16-bit instruction as an int, or raises ValueError with the error
+# message for a bad operand
+Fixups = list[tuple[int, str]]
+
+# LOAD, LOADA, STORE, STOREA: opcode, register, 8-bit address
+def _encode_reg_imm( line: list[str], op: int, fixups: Fixups, here: int ) -> int:
+    return op | tableB[line[1]] << 8 | dec2bin8(line[2])
+
+# BRA, BRAZ, BRAN, BRAO, BRAC, CALL: 8-bit prefix, 8-bit label address
+# the label address is filled in by assemble once all labels are known
+def _encode_branch( line: list[str], op: int, fixups: Fixups, here: int ) -> int:
+    fixups.append( (here, line[1]) )
+    return op
+
+# RETURN, HALT: the opcode is the whole instruction
+def _encode_fixed( line: list[str], op: int, fixups: Fixups, here: int ) -> int:
+    return op
+
+# PUSH, POP: opcode, register (including pc and cr)
+def _encode_stack( line: list[str], op: int, fixups: Fixups, here: int ) -> int:
+    return op | tableC[line[1]] << 9
 
-        newwords = []
-        for word in words:
-            newwords.append( word.lower() )
+# OPORT: opcode, source register (including pc and ir)
+def _encode_oport( line: list[str], op: int, fixups: Fixups, here: int ) -> int:
+    return op | tableD[line[1]] << 9
 
-        tokens.append( newwords )
+# IPORT: opcode, destination register
+def _encode_iport( line: list[str], op: int, fixups: Fixups, here: int ) -> int:
+    return op | tableB[line[1]] << 9
 
-    return tokens
+# ADD, SUB, AND, OR, XOR: opcode, source A, source B, destination
+def _encode_alu( line: list[str], op: int, fixups: Fixups, here: int ) -> int:
+    return op | tableE[line[1]] << 9 | tableE[line[2]] << 6 | tableB[line[3]]
 
+# SHIFTL, SHIFTR, ROTL, ROTR: opcode, source, destination
+def _encode_unary( line: list[str], op: int, fixups: Fixups, here: int ) -> int:
+    return op | tableE[line[1]] << 8 | tableB[line[2]]
 
-# reads through the file and returns a dictionary of all location
-# labels with their line numbers
-labels = {}
-instructions = []
-def pass1( tokens ):
-    #create a dictionary [label:line number]
-    counter = 0
+# MOVE: opcode, source register (including pc and ir), destination
+def _encode_move( line: list[str], op: int, fixups: Fixups, here: int ) -> int:
+    return op | tableD[line[1]] << 8 | tableB[line[2]]
+
+# MOVEI: opcode, 8-bit value, destination
+def _encode_movei( line: list[str], op: int, fixups: Fixups, here: int ) -> int:
+    return op | dec2comp8(line[1]) << 3 | tableB[line[2]]
+
+
+# mnemonic -> (encoder, opcode bits already in place in the word)
+Encoder = Callable[[list[str], int, Fixups, int], int]
+HANDLERS: dict[str, tuple[Encoder, int]] = {
+    "load":   (_encode_reg_imm, 0b00000 << 11),
+    "loada":  (_encode_reg_imm, 0b00001 << 11),
+    "store":  (_encode_reg_imm, 0b00010 << 11),
+    "storea": (_encode_reg_imm, 0b00011 << 11),
+    "bra":    (_encode_branch, 0b00100000 << 8),
+    "braz":   (_encode_branch, 0b00110000 << 8),
+    "brao":   (_encode_branch, 0b00110001 << 8),
+    "bran":   (_encode_branch, 0b00110010 << 8),
+    "brac":   (_encode_branch, 0b00110011 << 8),
+    "call":   (_encode_branch, 0b00110100 << 8),
+    "return": (_encode_fixed, 0b0011100000000000),
+    "halt":   (_encode_fixed, 0b0011110000000000),
+    "push":   (_encode_stack, 0b0100 << 12),
+    "pop":    (_encode_stack, 0b0101 << 12),
+    "oport":  (_encode_oport, 0b0110 << 12),
+    "iport":  (_encode_iport, 0b0111 << 12),
+    "add":    (_encode_alu, 0b1000 << 12),
+    "sub":    (_encode_alu, 0b1001 << 12),
+    "and":    (_encode_alu, 0b1010 << 12),
+    "or":     (_encode_alu, 0b1011 << 12),
+    "xor":    (_encode_alu, 0b1100 << 12),
+    "shiftl": (_encode_unary, 0b11010 << 11),
+    "shiftr": (_encode_unary, 0b11011 << 11),
+    "rotl":   (_encode_unary, 0b11100 << 11),
+    "rotr":   (_encode_unary, 0b11101 << 11),
+    "move":   (_encode_move, 0b11110 << 11),
+    "movei":  (_encode_movei, 0b11111 << 11),
+}
+
+
+# builds the machine instructions from the tokens in a single pass
+# returns the instruction words and a dictionary of error messages
+# keyed by instruction address
+def assemble( tokens: Iterable[list[str]] ) -> tuple[array[int], dict[int, str]]:
+    out: array[int] = array('H')
+    errors: dict[int, str] = {}
+    labels: dict[str, int] = {}
+    fixups: Fixups = []
     for line in tokens:
+        #a label takes the address of the next instruction
         if line[0][-1] == ":":
-            labels[line[0][:-1]] = counter
-        else:
-            instructions.append(line)
-            counter = counter +1  
-    return labels, instructions
-
-
-
-def pass2( instructions, labels ):
-    instr = ""
-    reg = ""
-    reg2 = ""
-    reg3 = ""
-    num = ""
-    label = ""
-    full_instr = ""
-    newLabel = ""
-    #CPU tables
-    tableB = {"ra":"000", "rb":"001", "rc":"010", "rd":"011","re":"100","sp":"101"}
-    tableC = {"ra":"000", "rb":"001", "rc":"010", "rd":"011","re":"100","sp":"101", "pc":"110","cr":"111"}
-    tableD = {"ra":"000", "rb":"001", "rc":"010", "rd":"011","re":"100","sp":"101", "pc":"110","ir":"111"}
-    tableE = {"ra":"000", "rb":"001", "rc":"010", "rd":"011","re":"100","sp":"101", "zero":"000000000000000","one":"111111111111111"}
-    list = []
-    for line in instructions:
-        #building the opcodes mostly
+            labels[line[0][:-1]] = len(out)
+            continue
+
+        #building the opcodes with one lookup per instruction
+        handler = HANDLERS.get(line[0])
         if len(line) > 4:
-             full_instr = "ERROR: an instruction is too long, CHECK: unneeded arguments"
-        elif line[0] == "load":
-            instr = "00000"
-            reg = tableB[line[1]]
-            num = bin(int(line[2]))[2:]
-            while len(num) != 8:
-                num = "0" + num
-            full_instr = instr + reg + num
-        elif line[0] == "loada":
-            instr = "00001"
-            reg = tableB[line[1]]
-            num = bin(int(line[2]))[2:]
-            while len(num) != 8:
-                num = "0" + num
-            full_instr = instr + reg + num
-        elif line [0] == "store":
-            instr = "00010"
-            reg = tableB[line[1]]
-            num = bin(int(line[2]))[2:]
-            while len(num) != 8:
-                num = "0" + num
-            full_instr = instr + reg + num
-        elif line[0] == "storea":
-            instr = "00011"
-            reg = tableB[line[1]]
-            num = bin(int(line[2]))[2:]
-            while len(num) != 8:
-                num = "0" + num
-            full_instr = instr + reg + num
-        elif line[0] == "bra":
-            instr = "0010"
-            label = labels[line[1]]
-            num = bin(label)[2:]
-            while len(num) != 8:
-                num = "0" + num
-            full_instr = instr + "0000" + num
-        elif line[0] == "braz":
-            instr = "00110000"
-            label = labels[line[1]]
-            num = bin(label)[2:]
-            while len(num) != 8:
-                num = "0" + num
-            full_instr = instr + num
-        elif line[0] == "bran":
-            instr = "00110010"
-            label = labels[line[1]]
-            num = bin(label)[2:]
-            while len(num) != 8:
-                num = "0" + num
-            full_instr = instr + num
-        elif line[0] == "brao":
-            instr = "00110001"
-            label = labels[line[1]]
-            num = bin(label)[2:]
-            print(num)
-            while len(num) != 8:
-                num = "0" + num
-            full_instr = instr + num
-        elif line[0] == "brac":
-            instr = "00110011"
-            label = labels[line[1]]
-            num = bin(label)[2:]
-            while len(num) != 8:
-                num = "0" + num
-            full_instr = instr + num
-        elif line[0] == "call":
-            instr = "001101"
-            label = labels[line[1]]
-            num = bin(int(label))[2:]
-            while len(num) != 8:
-                num = "0" + num
-            full_instr = instr + "00" + num
-            print(full_instr)
-        elif line[0] == "return":
-            print("return")
-            full_instr = "0011100000000000"
-        elif line[0] == "halt":
-            full_instr = "0011110000000000"
-        elif line[0] == "push":
-            instr = "0100"
-        elif line[0] == "pop":
-            instr = "0101"
-        elif line[0] == "oport":
-            instr = "0110"
-            reg = tableD[line[1]]
-            full_instr = instr + reg + "000000000"
-        elif line[0] == "iport":
-            instr = "0111"
-            reg = tableB[line[1]]
-            full_instr = instr + reg + "000000000"
-        elif line[0] == "add":
-            instr = "1000"
-            reg = tableE[line[1]]
-            reg2 = tableE[line[2]]
-            reg3 = tableB[line[3]]
-            full_instr = instr + reg + reg2 + "000" + reg3
-        elif line[0] == "sub":
-            instr = "1001"
-            reg = tableE[line[1]]
-            reg2 = tableE[line[2]]
-            reg3 = tableB[line[3]]
-            full_instr = instr + reg + reg2 + "000" + reg3
-        elif line[0] == "and":
-            instr = "1010"
-            reg = tableE[line[1]]
-            reg2 = tableE[line[2]]
-            reg3 = tableB[line[3]]
-            full_instr = instr + reg + reg2 + "000" + reg3
-        elif line[0] == "or":
-            instr = "1011"
-            reg = tableE[line[1]]
-            reg2 = tableE[line[2]]
-            reg3 = tableB[line[3]]
-            full_instr = instr + reg + reg2 + "000" + reg3
-        elif line[0] == "xor":
-            instr = "1100"
-            reg = tableE[line[1]]
-            reg2 = tableE[line[2]]
-            reg3 = tableB[line[3]]
-            full_instr = instr + reg + reg2 + "000" + reg3
-        elif line[0] == "shiftl":
-            instr = "11010"
-            reg = tableE[line[1]]
-            reg2 = tableB[line[2]]
-            full_instr = instr + reg + "00000" + reg2
-        elif line[0] == "shiftr":
-            instr = "11011"
-            reg = tableE[line[1]]
-            reg2 = tableB[line[2]]
-            full_instr = instr + reg + "00000" + reg2
-        elif line[0] == "rotl":
-            instr = "11100"
-            reg = tableE[line[1]]
-            reg2 = tableB[line[2]]
-            full_instr = instr + reg + "00000" + reg2
-        elif line[0] == "rotr":
-            instr = "11101"
-            reg = tableE[line[1]]
-            reg2 = tableB[line[2]]
-            full_instr = instr + reg + "00000" + reg2
-        elif line[0] == "move":
-            instr = "11110"
-            reg = tableD[line[1]]
-            reg2 = tableB[line[2]]
-            full_instr = instr + reg + "00000" + reg2
-        elif line[0] == "movei":
-            instr = "11111"
-            num = bin(int(line[1]))[2:]
-            while len(num) != 8:
-                num = "0" + num
-            reg2 = tableB[line[2]]
-            full_instr = instr + num + reg2
+            errors[len(out)] = "ERROR: an instruction is too long, CHECK: unneeded arguments"
+            word = 0
+        elif handler is None:
+            errors[len(out)] = "ERROR: an instruction is not found, CHECK: spelling and spacing"
+            word = 0
+        else:
+            fn, op = handler
+            try:
+                word = fn(line, op, fixups, len(out))
+            except ValueError as e:
+                errors[len(out)] = str(e)
+                word = 0
+        out.append(word)
+
+    #patch the label addresses now that every label is known
+    for here, name in fixups:
+        if name not in labels:
+            errors[here] = "ERROR: a label is not found, CHECK: spelling"
+        elif labels[name] > 0xFF:
+            errors[here] = "ERROR: a label is out of range, CHECK: program is longer than 256 instructions"
         else:
-            full_instr = "ERROR: an instruction is not found, CHECK: spelling and spacing"
-        list.append(full_instr)
+            out[here] |= labels[name]
 
-    print("-- program memory file for text.a \nDEPTH = 256;\nWIDTH = 16;\nADDRESS_RADIX = HEX;\nDATA_RADIX = BIN;\nCONTENT\nBEGIN")
-    for line, single_instr in enumerate(list):
-        if single_instr != list[-1]:
-            print("%02X : %s;" % (line, single_instr))
-        elif single_instr == list[-1]:
-            print("[%02X...FF] : %s;" % (line, single_instr))
+    return out, errors
 
 
-def main( argv ):
+# writes the instruction words to stdout in the format of a mif file
+def write_mif( out: array[int], errors: dict[int, str] ) -> None:
+    lines = ["-- program memory file for text.a \nDEPTH = 256;\nWIDTH = 16;\nADDRESS_RADIX = HEX;\nDATA_RADIX = BIN;\nCONTENT\nBEGIN\n"]
+    last = len(out) - 1
+    for i, word in enumerate(out):
+        text = errors.get(i) or format(word, '016b')
+        if i != last:
+            lines.append("%02X : %s;\n" % (i, text))
+        else:
+            lines.append("[%02X...FF] : %s;\n" % (i, text))
+
+    sys.stdout.write(''.join(lines))
+
+
+def main( argv: list[str] ) -> None:
     if len(argv) < 2:
-        print('Usage: python %s <filename>') % (argv[0])
-        exit()
-
-    fp = open( argv[1], 'r' )
-   
-    tokens = tokenize( fp )
-    pass1(tokens)
-    pass2(instructions, labels)
-    fp.close()
+        sys.exit( 'Usage: python %s <filename>' % (argv[0]) )
+
+    # read the whole source on the raw file descriptor; st_size is only a
+    # hint, it is 0 for pipes and a read can return fewer bytes than asked
+    fd = os.open( argv[1], os.O_RDONLY )
+    try:
+        size = max( os.fstat( fd ).st_size, 4096 )
+        chunks = []
+        while True:
+            chunk = os.read( fd, size )
+            if not chunk:
+                break
+            chunks.append( chunk )
+    finally:
+        os.close( fd )
+
+    out, errors = assemble( tokenize( b''.join( chunks ).decode().splitlines() ) )
+
+    write_mif( out, errors )
 
 if __name__ == "__main__":
     main(sys.argv)